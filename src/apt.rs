@@ -1,5 +1,7 @@
 use lazy_static::lazy_static;
 use regex::{Regex, RegexBuilder};
+use std::cell::RefCell;
+use std::collections::BTreeSet;
 use std::str::FromStr;
 
 use crate::command_ext::Command;
@@ -78,10 +80,32 @@ pub fn simulate_satisfy(deps: &[&str]) -> Result<Summary> {
     }
 }
 
-pub fn check_satisfied(deps: &[&str]) {
+/// Sets of Debian packages that `apt-get` found to be satisfied.
+///
+/// Updating packages creates many environments with overlapping
+/// dependencies. This remembers which sets were satisfied to avoid running
+/// `apt-get` again for them (or for any subset of them).
+#[derive(Default)]
+pub struct Satisfied(RefCell<Vec<BTreeSet<String>>>);
+
+pub fn check_satisfied(deps: &[&str], satisfied: &Satisfied) {
+    if satisfied
+        .0
+        .borrow()
+        .iter()
+        .any(|set| deps.iter().all(|dep| set.contains(*dep)))
+    {
+        return;
+    }
+
     match simulate_satisfy(deps) {
         Ok(summary) => {
-            if !summary.was_satisfied() {
+            if summary.was_satisfied() {
+                satisfied
+                    .0
+                    .borrow_mut()
+                    .push(deps.iter().map(|dep| (*dep).to_owned()).collect());
+            } else {
                 warn(anyhow!("apt dependencies unsatisfied: {deps:?}"));
             }
         }
@@ -1,5 +1,7 @@
+use std::cell::RefCell;
 use std::collections::BTreeSet;
-use std::io::{self, Write};
+use std::fs::File;
+use std::io::{self, Seek, Write};
 use std::os::unix::fs::PermissionsExt;
 use std::path::Path;
 use std::process::{ChildStdout, Stdio};
@@ -8,7 +10,10 @@ use tempfile::NamedTempFile;
 
 use super::apt;
 use super::command_ext::Command;
-use super::fs_util::{rmtree, summarize_dir, try_exists, try_iterdir, DirSummary};
+use super::fs_util::{
+    create_dir_or_subvolume, rmtree, rmtrees, summarize_dirs, try_delete_subvolume, try_exists,
+    try_iterdir, DirSummary, DirSummaryCache,
+};
 use super::paths::EnvPath;
 use super::runner::{EnvFilesSummary, EnvironmentExists, Init, Runner, RunnerCommand};
 use super::{CubicleShared, EnvironmentName, ExitStatusError, HostPath};
@@ -18,6 +23,9 @@ pub struct Bubblewrap {
     pub(super) program: Rc<CubicleShared>,
     home_dirs: HostPath,
     work_dirs: HostPath,
+    /// The seccomp filter, opened on first use and kept open so that it's not
+    /// re-opened for every `bwrap` invocation.
+    seccomp: RefCell<Option<File>>,
 }
 
 struct Dirs {
@@ -49,6 +57,7 @@ impl Bubblewrap {
             program,
             home_dirs,
             work_dirs,
+            seccomp: RefCell::new(None),
         })
     }
 
@@ -68,6 +77,25 @@ impl Bubblewrap {
             .expect("Bubblewrap config needed")
     }
 
+    /// Creates an environment's home directory, as a btrfs subvolume if
+    /// configured.
+    fn create_home_dir(&self, host_home: &HostPath) -> Result<()> {
+        if self.config().btrfs_subvolumes {
+            create_dir_or_subvolume(host_home)
+        } else {
+            std::fs::create_dir_all(host_home.as_host_raw())
+                .with_context(|| format!("Failed to create directory: {:?}", host_home))
+        }
+    }
+
+    /// Deletes an environment's home directory if it's a btrfs subvolume and
+    /// subvolumes are configured. Callers still need to `rmtree` it.
+    fn try_delete_home_subvolume(&self, host_home: &HostPath) {
+        if self.config().btrfs_subvolumes {
+            try_delete_subvolume(host_home);
+        }
+    }
+
     fn init(
         &self,
         name: &EnvironmentName,
@@ -82,6 +110,7 @@ impl Bubblewrap {
                 .iter()
                 .map(|s| s.as_str())
                 .collect::<Vec<&str>>(),
+            &self.program.apt_satisfied,
         );
 
         if !seeds.is_empty() {
@@ -143,6 +172,34 @@ impl Bubblewrap {
         )
     }
 
+    /// Returns a new file descriptor for the seccomp filter, or None if it's
+    /// disabled.
+    ///
+    /// The returned file shares its offset with the memoized one, so it's
+    /// rewound to the start for each caller.
+    fn seccomp_file(&self) -> Result<Option<File>> {
+        use super::config::PathOrDisabled::*;
+        let path = match &self.config().seccomp {
+            Path(path) => path,
+            DangerouslyDisabled => return Ok(None),
+        };
+        let mut cached = self.seccomp.borrow_mut();
+        if cached.is_none() {
+            *cached = Some(
+                File::open(path)
+                    .with_context(|| format!("failed to open seccomp filter: {path:?}"))?,
+            );
+        }
+        let mut file = cached
+            .as_ref()
+            .unwrap()
+            .try_clone()
+            .with_context(|| format!("failed to duplicate seccomp filter: {path:?}"))?;
+        file.rewind()
+            .with_context(|| format!("failed to rewind seccomp filter: {path:?}"))?;
+        Ok(Some(file))
+    }
+
     fn bwrap(
         &self,
         name: &EnvironmentName,
@@ -153,16 +210,7 @@ impl Bubblewrap {
             host_work,
         } = self.dirs(name);
 
-        let seccomp: Option<std::fs::File> = {
-            use super::config::PathOrDisabled::*;
-            match &self.config().seccomp {
-                Path(path) => Some(
-                    std::fs::File::open(path)
-                        .with_context(|| format!("failed to open seccomp filter: {path:?}"))?,
-                ),
-                DangerouslyDisabled => None,
-            }
-        };
+        let seccomp = self.seccomp_file()?;
 
         let mut command = Command::new("bwrap");
 
@@ -253,19 +301,12 @@ impl Bubblewrap {
             }
         }
 
-        let status = match stdin {
-            None => command.status(),
-            Some(mut reader) => {
-                command.stdin(Stdio::piped());
-                let mut child = command.scoped_spawn()?;
-                {
-                    let mut writer = child.stdin().take().unwrap();
-                    io::copy(&mut reader, &mut writer).todo_context()?;
-                    // drop writer to close stdin
-                }
-                child.wait()
-            }
-        }?;
+        if let Some(reader) = stdin {
+            // Hand the pipe to bwrap directly rather than copying the data
+            // through this process.
+            command.stdin(reader);
+        }
+        let status = command.status()?;
 
         if status.success() {
             Ok(())
@@ -330,7 +371,7 @@ impl Runner for Bubblewrap {
             host_home,
             host_work,
         } = self.dirs(name);
-        std::fs::create_dir_all(&host_home.as_host_raw()).todo_context()?;
+        self.create_home_dir(&host_home)?;
         std::fs::create_dir_all(&host_work.as_host_raw()).todo_context()?;
         self.init(name, init)
     }
@@ -384,31 +425,25 @@ impl Runner for Bubblewrap {
         Ok(Vec::from_iter(envs))
     }
 
-    fn files_summary(&self, name: &EnvironmentName) -> Result<EnvFilesSummary> {
+    fn files_summary(
+        &self,
+        name: &EnvironmentName,
+        cache: Option<&DirSummaryCache>,
+    ) -> Result<EnvFilesSummary> {
         let Dirs {
             host_home: home_dir,
             host_work: work_dir,
         } = self.dirs(name);
 
-        let home_dir_exists = try_exists(&home_dir).todo_context()?;
-        let home_dir_summary = if home_dir_exists {
-            summarize_dir(&home_dir)?
-        } else {
-            DirSummary::new_with_errors()
-        };
-
-        let work_dir_exists = try_exists(&work_dir).todo_context()?;
-        let work_dir_summary = if work_dir_exists {
-            summarize_dir(&work_dir)?
-        } else {
-            DirSummary::new_with_errors()
-        };
+        let mut summaries = summarize_dirs(&[&home_dir, &work_dir], cache)?.into_iter();
+        let home_dir_summary = summaries.next().unwrap();
+        let work_dir_summary = summaries.next().unwrap();
 
         Ok(EnvFilesSummary {
-            home_dir_path: home_dir_exists.then_some(home_dir),
-            home_dir: home_dir_summary,
-            work_dir_path: work_dir_exists.then_some(work_dir),
-            work_dir: work_dir_summary,
+            home_dir_path: home_dir_summary.is_some().then_some(home_dir),
+            home_dir: home_dir_summary.unwrap_or_else(DirSummary::new_with_errors),
+            work_dir_path: work_dir_summary.is_some().then_some(work_dir),
+            work_dir: work_dir_summary.unwrap_or_else(DirSummary::new_with_errors),
         })
     }
 
@@ -417,8 +452,9 @@ impl Runner for Bubblewrap {
             host_home,
             host_work,
         } = self.dirs(name);
+        self.try_delete_home_subvolume(&host_home);
         rmtree(&host_home)?;
-        std::fs::create_dir_all(host_home.as_host_raw()).todo_context()?;
+        self.create_home_dir(&host_home)?;
         std::fs::create_dir_all(host_work.as_host_raw()).todo_context()?;
         self.init(name, init)
     }
@@ -428,8 +464,12 @@ impl Runner for Bubblewrap {
             host_home,
             host_work,
         } = self.dirs(name);
-        rmtree(&host_home)?;
-        rmtree(&host_work)
+        self.try_delete_home_subvolume(&host_home);
+        rmtrees(&[&host_home, &host_work])?;
+        for dir in [&host_home, &host_work] {
+            self.program.dir_summary_cache.forget(dir);
+        }
+        Ok(())
     }
 
     fn run(&self, name: &EnvironmentName, run: &RunnerCommand) -> Result<()> {
@@ -12,33 +12,35 @@ use std::fmt;
 /// A count of bytes. This type is useful for its [`fmt::Display`] impl.
 pub struct Bytes(pub u64);
 
+/// Each SI unit with the smallest number of bytes displayed in that unit and
+/// the number of bytes in one of that unit.
+///
+/// Past kB, the thresholds are just below the powers of 1000 so that values
+/// don't round up to "1000.0" of a smaller unit.
+const UNITS: [(u64, u64, &str); 6] = [
+    (1_000, 1_000, "kB"),
+    (999_950, 1_000_000, "MB"),
+    (999_950_000, 1_000_000_000, "GB"),
+    (999_950_000_000, 1_000_000_000_000, "TB"),
+    (999_950_000_000_000, 1_000_000_000_000_000, "PB"),
+    (999_950_000_000_000_000, 1_000_000_000_000_000_000, "EB"),
+];
+
 impl fmt::Display for Bytes {
     fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
-        if self.0 < 1_000 {
-            write!(f, "{} B", self.0)
-        } else if self.0 < 999_950 {
-            write!(f, "{:.1} kB", (self.0 as f64) / 1e3)
-        } else if self.0 < 999_950_000 {
-            write!(f, "{:.1} MB", (self.0 as f64) / 1e6)
-        } else if self.0 < 999_950_000_000 {
-            write!(f, "{:.1} GB", (self.0 as f64) / 1e9)
-        } else if self.0 < 999_950_000_000_000 {
-            write!(f, "{:.1} TB", (self.0 as f64) / 1e12)
-        } else if self.0 < 999_950_000_000_000_000 {
-            write!(
-                f,
-                "{:.1} PB",
-                if self.0 <= 9_007_199_254_740_992 {
-                    (self.0 as f64) / 1e15
-                } else {
-                    // Larger integers can't be represented exactly in an f64.
-                    // It's probably best to divide some first.
-                    (self.0 / 1_000_000_000_000) as f64 / 1e3
-                }
-            )
-        } else {
-            write!(f, "{:.1} EB", (self.0 / 1_000_000_000_000_000) as f64 / 1e3)
+        let i = UNITS.partition_point(|(min, _, _)| *min <= self.0);
+        if i == 0 {
+            return write!(f, "{} B", self.0);
         }
+        let (_, divisor, unit) = UNITS[i - 1];
+        let value = if self.0 <= 9_007_199_254_740_992 {
+            (self.0 as f64) / (divisor as f64)
+        } else {
+            // Larger integers can't be represented exactly in an f64.
+            // It's probably best to divide some first.
+            (self.0 / (divisor / 1_000)) as f64 / 1e3
+        };
+        write!(f, "{value:.1} {unit}")
     }
 }
 
@@ -59,6 +59,9 @@ pub struct Config {
 #[serde(deny_unknown_fields)]
 #[allow(missing_docs)]
 pub struct Bubblewrap {
+    #[serde(default)]
+    pub btrfs_subvolumes: bool,
+
     pub seccomp: PathOrDisabled,
 }
 
@@ -349,6 +352,7 @@ mod tests {
                 auto_update: Some(Duration::from_secs(60 * 60 * 24 * 10)),
                 builtin_package_dir: Some(PathBuf::from("/usr/local/share/cubicle/packages")),
                 bubblewrap: Some(Bubblewrap {
+                    btrfs_subvolumes: true,
                     seccomp: PathOrDisabled::Path(PathBuf::from("/tmp/seccomp.bpf")),
                 }),
                 docker: Docker {
@@ -365,6 +369,7 @@ mod tests {
                 builtin_package_dir = '/usr/local/share/cubicle/packages'
 
                 [bubblewrap]
+                btrfs_subvolumes = true
                 seccomp = '/tmp/seccomp.bpf'
 
                 [docker]
@@ -10,7 +10,9 @@ use std::str::FromStr;
 use std::time::{Duration, UNIX_EPOCH};
 
 use super::command_ext::Command;
-use super::fs_util::{rmtree, summarize_dir, try_exists, try_iterdir, DirSummary};
+use super::fs_util::{
+    rmtree, rmtrees, summarize_dirs, try_exists, try_iterdir, DirSummary, DirSummaryCache,
+};
 use super::os_util::{get_timezone, get_uids, Uids};
 use super::paths::EnvPath;
 use super::runner::{EnvFilesSummary, EnvironmentExists, Init, Runner, RunnerCommand};
@@ -22,7 +24,6 @@ use names::{ContainerName, ImageName, VolumeName};
 
 pub struct Docker {
     pub(super) program: Rc<CubicleShared>,
-    timezone: String,
     mounts: Mounts,
     base_image: ImageName,
     container_home: EnvPath,
@@ -49,8 +50,6 @@ enum EnvMounts {
 
 impl Docker {
     pub(super) fn new(program: Rc<CubicleShared>) -> Result<Self> {
-        let timezone = get_timezone();
-
         let mounts = if program.config.docker.bind_mounts {
             let xdg_cache_home = match std::env::var("XDG_CACHE_HOME") {
                 Ok(path) => HostPath::try_from(path)?,
@@ -85,7 +84,6 @@ impl Docker {
 
         Ok(Self {
             program,
-            timezone,
             mounts,
             base_image,
             container_home,
@@ -198,7 +196,10 @@ impl Docker {
                 &mut stdin,
                 DockerfileArgs {
                     packages: &packages,
-                    timezone: &self.timezone,
+                    // This is only looked up here, rather than in `new`,
+                    // so that other commands (like shell completions)
+                    // don't pay for it or print its warnings.
+                    timezone: &get_timezone(),
                     user: &self.program.user,
                     uids: &get_uids(),
                 },
@@ -869,31 +870,25 @@ impl Runner for Docker {
         Ok(Vec::from_iter(envs))
     }
 
-    fn files_summary(&self, name: &EnvironmentName) -> Result<EnvFilesSummary> {
+    fn files_summary(
+        &self,
+        name: &EnvironmentName,
+        cache: Option<&DirSummaryCache>,
+    ) -> Result<EnvFilesSummary> {
         match self.mounts(name) {
             EnvMounts::BindMounts {
                 host_home: home_dir,
                 host_work: work_dir,
             } => {
-                let home_dir_exists = try_exists(&home_dir).todo_context()?;
-                let home_dir_summary = if home_dir_exists {
-                    summarize_dir(&home_dir)?
-                } else {
-                    DirSummary::new_with_errors()
-                };
-
-                let work_dir_exists = try_exists(&work_dir).todo_context()?;
-                let work_dir_summary = if work_dir_exists {
-                    summarize_dir(&work_dir)?
-                } else {
-                    DirSummary::new_with_errors()
-                };
+                let mut summaries = summarize_dirs(&[&home_dir, &work_dir], cache)?.into_iter();
+                let home_dir_summary = summaries.next().unwrap();
+                let work_dir_summary = summaries.next().unwrap();
 
                 Ok(EnvFilesSummary {
-                    home_dir_path: home_dir_exists.then_some(home_dir),
-                    home_dir: home_dir_summary,
-                    work_dir_path: work_dir_exists.then_some(work_dir),
-                    work_dir: work_dir_summary,
+                    home_dir_path: home_dir_summary.is_some().then_some(home_dir),
+                    home_dir: home_dir_summary.unwrap_or_else(DirSummary::new_with_errors),
+                    work_dir_path: work_dir_summary.is_some().then_some(work_dir),
+                    work_dir: work_dir_summary.unwrap_or_else(DirSummary::new_with_errors),
                 })
             }
 
@@ -931,8 +926,11 @@ impl Runner for Docker {
                 host_home,
                 host_work,
             } => {
-                rmtree(host_home)?;
-                rmtree(host_work)
+                rmtrees(&[host_home, host_work])?;
+                for dir in [host_home, host_work] {
+                    self.program.dir_summary_cache.forget(dir);
+                }
+                Ok(())
             }
 
             EnvMounts::Volumes {
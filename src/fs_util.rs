@@ -1,9 +1,15 @@
-use std::ffi::OsString;
+use serde::{Deserialize, Serialize};
+use std::collections::HashSet;
+use std::ffi::{OsStr, OsString};
 use std::io;
-use std::path::PathBuf;
+use std::path::{Path, PathBuf};
+use std::process::Stdio;
 use std::rc::Rc;
-use std::time::{SystemTime, UNIX_EPOCH};
+use std::sync::{Condvar, Mutex};
+use std::time::{Duration, SystemTime, UNIX_EPOCH};
 
+use super::command_ext::Command;
+use super::encoding::FilenameEncoder;
 use super::HostPath;
 use crate::somehow::{somehow as anyhow, Context, Result};
 
@@ -11,6 +17,117 @@ pub fn rmtree(path: &HostPath) -> Result<()> {
     rmtree_(path).with_context(|| format!("Failed to recursively remove directory: {:?}", path))
 }
 
+/// Calls [`rmtree`] on each of the given directories concurrently (see
+/// [`for_each_concurrently`]). All the removals run to completion, and the
+/// first error (in the order given) is returned.
+pub fn rmtrees(paths: &[&HostPath]) -> Result<()> {
+    for_each_concurrently(paths, rmtree).into_iter().collect()
+}
+
+/// Calls `f` on each of the given paths, each on its own thread, and returns
+/// the results in the same order.
+///
+/// This is meant for operations on whole directory trees, like walking or
+/// removing them, which are mostly bound by filesystem latency rather than
+/// CPU.
+fn for_each_concurrently<T, F>(paths: &[&HostPath], f: F) -> Vec<T>
+where
+    T: Send,
+    F: Fn(&HostPath) -> T + Sync,
+{
+    let f = &f;
+    std::thread::scope(|scope| {
+        let handles = paths
+            .iter()
+            .map(|path| scope.spawn(move || f(*path)))
+            .collect::<Vec<_>>();
+        handles
+            .into_iter()
+            .map(|handle| handle.join().expect("thread working on directory panicked"))
+            .collect()
+    })
+}
+
+/// Creates the directory `path`, along with its parents, if it doesn't exist.
+///
+/// On btrfs, `path` is created as a subvolume if possible, so that
+/// [`try_delete_subvolume`] can later delete it without walking its contents.
+pub fn create_dir_or_subvolume(path: &HostPath) -> Result<()> {
+    let create = || -> Result<()> {
+        if try_exists(path).todo_context()? {
+            return Ok(());
+        }
+        if let Some(parent) = path.as_host_raw().parent() {
+            std::fs::create_dir_all(parent).todo_context()?;
+            if is_btrfs(parent) {
+                let status = Command::new("btrfs")
+                    .args(["subvolume", "create"])
+                    .arg(path.as_host_raw())
+                    .stdout(Stdio::null())
+                    .stderr(Stdio::null())
+                    .status();
+                if matches!(status, Ok(status) if status.success()) {
+                    return Ok(());
+                }
+            }
+        }
+        std::fs::create_dir_all(path.as_host_raw()).todo_context()
+    };
+    create().with_context(|| format!("Failed to create directory: {:?}", path))
+}
+
+/// Deletes `path` in one step if it's a btrfs subvolume, as created by
+/// [`create_dir_or_subvolume`].
+///
+/// This usually requires privileges or the `user_subvol_rm_allowed` mount
+/// option, so it may quietly do nothing. Callers should follow up with
+/// [`rmtree`], which does nothing if `path` is gone.
+pub fn try_delete_subvolume(path: &HostPath) {
+    if is_btrfs_subvolume(path) {
+        let _ = Command::new("btrfs")
+            .args(["subvolume", "delete"])
+            .arg(path.as_host_raw())
+            .stdout(Stdio::null())
+            .stderr(Stdio::null())
+            .status();
+    }
+}
+
+/// Returns true if `path` is on a btrfs filesystem.
+fn is_btrfs(path: &Path) -> bool {
+    #[cfg(target_os = "linux")]
+    return {
+        const BTRFS_SUPER_MAGIC: u32 = 0x9123_683E;
+        matches!(
+            rustix::fs::statfs(path),
+            Ok(stat) if stat.f_type as u32 == BTRFS_SUPER_MAGIC
+        )
+    };
+    #[allow(unreachable_code)]
+    false
+}
+
+/// Returns true if `path` is the top directory of a btrfs subvolume (and not
+/// a symlink to one).
+fn is_btrfs_subvolume(path: &HostPath) -> bool {
+    #[cfg(target_os = "linux")]
+    return {
+        use std::os::unix::fs::MetadataExt;
+        // The top directory of every btrfs subvolume has this inode number.
+        const BTRFS_FIRST_FREE_OBJECTID: u64 = 256;
+        match std::fs::symlink_metadata(path.as_host_raw()) {
+            Ok(metadata) => {
+                metadata.is_dir()
+                    && metadata.ino() == BTRFS_FIRST_FREE_OBJECTID
+                    && is_btrfs(path.as_host_raw())
+            }
+            Err(_) => false,
+        }
+    };
+    #[allow(unreachable_code)]
+    false
+}
+
 fn rmtree_(path: &HostPath) -> Result<()> {
     // This is a bit challenging for a few reasons:
     //
@@ -42,33 +159,63 @@ fn rmtree_(path: &HostPath) -> Result<()> {
         Err(e) => return Err(e).todo_context(),
     }
 
-    fn rm_contents(dir: &cap_std::fs::Dir) -> std::io::Result<()> {
+    // Removes everything inside `dir`. Permissions are only changed when
+    // opening or removing an entry of `dir` fails: `make_writable` is then
+    // called to make `dir` writable, and that operation is retried. Errors
+    // from deeper in the tree are returned as is, since changing `dir` won't
+    // help with those.
+    fn rm_contents(dir: &cap_std::fs::Dir, make_writable: &dyn Fn()) -> std::io::Result<()> {
+        let mut made_writable = false;
         for entry in dir.entries()? {
             let entry = entry?;
             let file_name = entry.file_name();
-            let file_type = entry.file_type()?;
-            if file_type.is_dir() {
-                let metadata = entry.metadata()?;
-                let mut permissions = metadata.permissions();
-                if permissions.readonly() {
-                    permissions.set_readonly(false);
-                    // This may fail for empty directories owned by root.
-                    // Continue anyway.
-                    let _ = dir.set_permissions(&file_name, permissions);
-                }
-                let child_dir = entry.open_dir()?;
-                rm_contents(&child_dir)?;
-                dir.remove_dir(file_name)?;
+            if entry.file_type()?.is_dir() {
+                let child_dir = retry(&mut made_writable, make_writable, || {
+                    dir.open_dir(&file_name)
+                })?;
+                rm_contents(&child_dir, &|| set_writable(dir, &file_name))?;
+                retry(&mut made_writable, make_writable, || {
+                    dir.remove_dir(&file_name)
+                })?;
             } else {
-                dir.remove_file(file_name)?;
+                retry(&mut made_writable, make_writable, || {
+                    dir.remove_file(&file_name)
+                })?;
             }
         }
         Ok(())
     }
 
+    fn retry<T>(
+        made_writable: &mut bool,
+        make_writable: &dyn Fn(),
+        op: impl Fn() -> std::io::Result<T>,
+    ) -> std::io::Result<T> {
+        match op() {
+            Err(e) if e.kind() == io::ErrorKind::PermissionDenied && !*made_writable => {
+                make_writable();
+                *made_writable = true;
+                op()
+            }
+            result => result,
+        }
+    }
+
+    fn set_writable(dir: &cap_std::fs::Dir, file_name: &OsStr) {
+        if let Ok(metadata) = dir.symlink_metadata(file_name) {
+            let mut permissions = metadata.permissions();
+            if permissions.readonly() {
+                permissions.set_readonly(false);
+                // This may fail for empty directories owned by root.
+                // Continue anyway.
+                let _ = dir.set_permissions(file_name, permissions);
+            }
+        }
+    }
+
     let dir = cap_std::fs::Dir::open_ambient_dir(path.as_host_raw(), cap_std::ambient_authority())
         .todo_context()?;
-    let _ = rm_contents(&dir); // ignore this error
+    let _ = rm_contents(&dir, &|| {}); // ignore this error
     dir.remove_open_dir_all().todo_context()?; // prefer this one
     Ok(())
 }
@@ -92,17 +239,37 @@ pub fn file_size(metadata: &std::fs::Metadata) -> Option<u64> {
     None
 }
 
-pub fn file_size_cap(metadata: &cap_std::fs::Metadata) -> Option<u64> {
+/// Returns the space allocated on disk for a file or directory, as `du`
+/// would count it for a single path.
+///
+/// This can differ from the file size for sparse files and because of
+/// filesystem block sizes. Counting a whole tree the way `du` does also
+/// requires skipping repeated hard links; see [`summarize_dir`].
+pub fn disk_usage_cap(metadata: &cap_std::fs::Metadata) -> Option<u64> {
     #[cfg(unix)]
     return {
         use std::os::unix::fs::MetadataExt;
-        Some(metadata.size())
+        // `st_blocks` is in 512-byte units regardless of the filesystem.
+        Some(metadata.blocks() * 512)
+    };
+    #[allow(unreachable_code)]
+    None
+}
+
+/// Returns the `(device, inode)` pair identifying a file that has more than
+/// one hard link, so that its disk usage can be counted only once, as `du`
+/// does.
+fn hard_link_id(metadata: &cap_std::fs::Metadata) -> Option<(u64, u64)> {
+    #[cfg(unix)]
+    return {
+        use std::os::unix::fs::MetadataExt;
+        (!metadata.is_dir() && metadata.nlink() > 1).then(|| (metadata.dev(), metadata.ino()))
     };
     #[allow(unreachable_code)]
     None
 }
 
-#[derive(Debug)]
+#[derive(Debug, Deserialize, Serialize)]
 pub struct DirSummary {
     pub errors: bool,
     pub total_size: u64,
@@ -110,6 +277,14 @@ pub struct DirSummary {
 }
 
 impl DirSummary {
+    fn new() -> Self {
+        Self {
+            errors: false,
+            total_size: 0,
+            last_modified: UNIX_EPOCH,
+        }
+    }
+
     pub fn new_with_errors() -> Self {
         Self {
             errors: true,
@@ -119,47 +294,313 @@ impl DirSummary {
     }
 }
 
+/// Walks a directory tree to calculate its disk usage and the most recent
+/// modification time of its contents.
+///
+/// Like `du -s`, the disk usage includes the directory itself, and files with
+/// several hard links inside the tree are counted once. Symlinks are not
+/// followed.
+///
+/// The walk is mostly bound by filesystem metadata latency, so it's split
+/// across several threads that share a queue of directories still to be
+/// listed. See [`summarize_dir_threads`] for the number of threads.
 pub fn summarize_dir(path: &HostPath) -> Result<DirSummary> {
-    fn handle_entry(summary: &mut DirSummary, entry: Result<WalkDirEntry>) {
-        match entry {
-            Ok(WalkDirEntry { entry, .. }) => {
-                let metadata = if let Ok(metadata) = entry.metadata() {
-                    metadata
-                } else {
+    summarize_dir_with_threads(path, summarize_dir_threads())
+}
+
+fn summarize_dir_with_threads(path: &HostPath, threads: usize) -> Result<DirSummary> {
+    struct Queue {
+        // Paths relative to the root. These aren't kept open to avoid running
+        // out of file descriptors on wide trees.
+        dirs: Vec<PathBuf>,
+        // Number of directories being listed. Listing one may add more
+        // directories to the queue, so the walk is only done once this
+        // reaches 0 with `dirs` empty.
+        active: usize,
+    }
+
+    fn list_dir(
+        root: &cap_std::fs::Dir,
+        path: &Path,
+        hard_links: &Mutex<HashSet<(u64, u64)>>,
+        summary: &mut DirSummary,
+        subdirs: &mut Vec<PathBuf>,
+    ) {
+        let dir = if path.as_os_str().is_empty() {
+            root.try_clone()
+        } else {
+            root.open_dir(path)
+        };
+        let entries = match dir.and_then(|dir| dir.entries()) {
+            Ok(entries) => entries,
+            Err(_) => {
+                summary.errors = true;
+                return;
+            }
+        };
+        for entry in entries {
+            let entry = match entry {
+                Ok(entry) => entry,
+                Err(_) => {
                     summary.errors = true;
-                    return;
-                };
-                match metadata.modified() {
-                    Ok(time) => {
-                        let time = time.into_std();
-                        if time > summary.last_modified {
-                            summary.last_modified = time;
-                        }
-                    }
-                    Err(_) => {
-                        summary.errors = true;
+                    continue;
+                }
+            };
+            let metadata = match entry.metadata() {
+                Ok(metadata) => metadata,
+                Err(_) => {
+                    summary.errors = true;
+                    continue;
+                }
+            };
+            match metadata.modified() {
+                Ok(time) => {
+                    let time = time.into_std();
+                    if time > summary.last_modified {
+                        summary.last_modified = time;
                     }
                 }
-                if !metadata.is_dir() {
-                    match file_size_cap(&metadata) {
-                        Some(size) => summary.total_size += size,
-                        None => summary.errors = true,
+                Err(_) => {
+                    summary.errors = true;
+                }
+            }
+            match disk_usage_cap(&metadata) {
+                Some(size) => {
+                    let first_link = match hard_link_id(&metadata) {
+                        Some(id) => hard_links.lock().unwrap().insert(id),
+                        None => true,
+                    };
+                    if first_link {
+                        summary.total_size += size;
                     }
                 }
+                None => summary.errors = true,
+            }
+            if metadata.is_dir() {
+                subdirs.push(path.join(entry.file_name()));
             }
-            Err(_) => summary.errors = true,
         }
     }
 
-    let mut summary = DirSummary {
-        errors: false,
-        total_size: 0,
+    let root = cap_std::fs::Dir::open_ambient_dir(path.as_host_raw(), cap_std::ambient_authority())
+        .todo_context()?;
+    let root_size = root
+        .dir_metadata()
+        .ok()
+        .and_then(|metadata| disk_usage_cap(&metadata));
+    let hard_links = Mutex::new(HashSet::new());
+    let queue = Mutex::new(Queue {
+        dirs: vec![PathBuf::new()],
+        active: 0,
+    });
+    let changed = Condvar::new();
+
+    let worker = || -> DirSummary {
+        let mut summary = DirSummary::new();
+        let mut subdirs = Vec::new();
+        loop {
+            let dir = {
+                let mut state = queue.lock().unwrap();
+                loop {
+                    if let Some(dir) = state.dirs.pop() {
+                        state.active += 1;
+                        break dir;
+                    }
+                    if state.active == 0 {
+                        return summary;
+                    }
+                    state = changed.wait(state).unwrap();
+                }
+            };
+            list_dir(&root, &dir, &hard_links, &mut summary, &mut subdirs);
+            let mut state = queue.lock().unwrap();
+            state.dirs.append(&mut subdirs);
+            state.active -= 1;
+            changed.notify_all();
+        }
+    };
+
+    let summaries = std::thread::scope(|scope| {
+        let handles = (0..threads)
+            .map(|_| scope.spawn(&worker))
+            .collect::<Vec<_>>();
+        handles
+            .into_iter()
+            .map(|handle| handle.join().expect("thread walking directory panicked"))
+            .collect::<Vec<_>>()
+    });
+    let summary = DirSummary {
+        errors: root_size.is_none(),
+        total_size: root_size.unwrap_or(0),
         last_modified: UNIX_EPOCH,
     };
+    Ok(summaries.into_iter().fold(summary, |a, b| DirSummary {
+        errors: a.errors || b.errors,
+        total_size: a.total_size + b.total_size,
+        last_modified: a.last_modified.max(b.last_modified),
+    }))
+}
+
+/// Returns true if anything inside `path` was modified after `time`.
+///
+/// This is cheaper than checking the `last_modified` from [`summarize_dir`],
+/// since it stops at the first newer entry. Entries whose metadata can't be
+/// read are skipped, just as they would only be flagged as errors in a
+/// [`DirSummary`].
+pub fn modified_since(path: &HostPath, time: SystemTime) -> Result<bool> {
     for entry in WalkDir::new(path)? {
-        handle_entry(&mut summary, entry);
+        let entry = match entry {
+            Ok(WalkDirEntry { entry, .. }) => entry,
+            Err(_) => continue,
+        };
+        if let Ok(modified) = entry.metadata().and_then(|metadata| metadata.modified()) {
+            if modified.into_std() > time {
+                return Ok(true);
+            }
+        }
+    }
+    Ok(false)
+}
+
+/// Returns the number of threads [`summarize_dir`] uses for each directory
+/// tree.
+///
+/// This defaults to the available parallelism, up to 8. It can be set with
+/// the environment variable `CUBICLE_DU_THREADS`.
+fn summarize_dir_threads() -> usize {
+    match std::env::var("CUBICLE_DU_THREADS")
+        .ok()
+        .and_then(|s| s.parse::<usize>().ok())
+    {
+        Some(threads) if threads > 0 => threads,
+        _ => std::thread::available_parallelism().map_or(1, |n| n.get().min(8)),
     }
-    Ok(summary)
+}
+
+/// Calls [`summarize_dir`], or [`DirSummaryCache::summarize_dir`] if `cache`
+/// is given, on each of the given directories concurrently (see
+/// [`for_each_concurrently`]). The result for a directory is `None` if it
+/// does not exist.
+pub fn summarize_dirs(
+    paths: &[&HostPath],
+    cache: Option<&DirSummaryCache>,
+) -> Result<Vec<Option<DirSummary>>> {
+    for_each_concurrently(paths, |path| -> Result<Option<DirSummary>> {
+        if !try_exists(path).todo_context()? {
+            return Ok(None);
+        }
+        match cache {
+            Some(cache) => cache.summarize_dir(path).map(Some),
+            None => summarize_dir(path).map(Some),
+        }
+    })
+    .into_iter()
+    .collect()
+}
+
+/// Stores [`DirSummary`] results on disk to avoid walking large directory
+/// trees every time.
+///
+/// A cached summary is reused while the newest modification time of the
+/// directory and its immediate children is unchanged, up to `MAX_AGE`. This
+/// is a cheap approximation: changes deeper in the tree may not be reflected
+/// until the cached entry expires. For that reason, the cache is only used
+/// for the table that `cub list` shows people by default.
+/// `Cubicle::get_environments` and `cub list --format=json` always walk the
+/// directories.
+///
+/// Entries are keyed by the directory's path. Runners call [`Self::forget`]
+/// when they delete an environment's directories.
+///
+/// Setting the environment variable `CUBICLE_DU_CACHE=0` disables the cache.
+pub struct DirSummaryCache {
+    dir: HostPath,
+    enabled: bool,
+}
+
+#[derive(Deserialize, Serialize)]
+struct CachedDirSummary {
+    fingerprint: SystemTime,
+    created: SystemTime,
+    summary: DirSummary,
+}
+
+impl DirSummaryCache {
+    const MAX_AGE: Duration = Duration::from_secs(60 * 60);
+
+    pub fn new(dir: HostPath) -> Self {
+        let enabled = !matches!(std::env::var("CUBICLE_DU_CACHE").as_deref(), Ok("0"));
+        Self { dir, enabled }
+    }
+
+    /// Like [`summarize_dir`] but may return a cached result.
+    pub fn summarize_dir(&self, path: &HostPath) -> Result<DirSummary> {
+        if !self.enabled {
+            return summarize_dir(path);
+        }
+        let fingerprint = match dir_fingerprint(path) {
+            Ok(fingerprint) => fingerprint,
+            Err(_) => return summarize_dir(path),
+        };
+        let cache_path = self.cache_path(path);
+
+        let now = SystemTime::now();
+        if let Some(cached) = std::fs::read(cache_path.as_host_raw())
+            .ok()
+            .and_then(|buf| serde_json::from_slice::<CachedDirSummary>(&buf).ok())
+        {
+            let fresh =
+                matches!(now.duration_since(cached.created), Ok(age) if age < Self::MAX_AGE);
+            if fresh && cached.fingerprint == fingerprint {
+                return Ok(cached.summary);
+            }
+        }
+
+        let cached = CachedDirSummary {
+            fingerprint,
+            created: now,
+            summary: summarize_dir(path)?,
+        };
+        // The cache is only an optimization, so ignore errors writing to it.
+        let _ = self.write(&cache_path, &cached);
+        Ok(cached.summary)
+    }
+
+    /// Removes any cached summary for `path`.
+    pub fn forget(&self, path: &HostPath) {
+        // The cache is only an optimization, so ignore errors here too.
+        let _ = std::fs::remove_file(self.cache_path(path).as_host_raw());
+    }
+
+    fn cache_path(&self, path: &HostPath) -> HostPath {
+        self.dir.join(
+            FilenameEncoder::new()
+                .push(&path.as_host_raw().to_string_lossy())
+                .push(".json")
+                .encode(),
+        )
+    }
+
+    fn write(&self, cache_path: &HostPath, cached: &CachedDirSummary) -> io::Result<()> {
+        std::fs::create_dir_all(self.dir.as_host_raw())?;
+        let file = tempfile::NamedTempFile::new_in(self.dir.as_host_raw())?;
+        serde_json::to_writer(file.as_file(), cached)?;
+        file.persist(cache_path.as_host_raw())?;
+        Ok(())
+    }
+}
+
+/// Returns the newest modification time of the directory and its immediate
+/// children.
+fn dir_fingerprint(path: &HostPath) -> io::Result<SystemTime> {
+    let mut newest = std::fs::symlink_metadata(path.as_host_raw())?.modified()?;
+    for entry in std::fs::read_dir(path.as_host_raw())? {
+        let modified = entry?.metadata()?.modified()?;
+        if modified > newest {
+            newest = modified;
+        }
+    }
+    Ok(newest)
 }
 
 pub fn try_iterdir(path: &HostPath) -> Result<Vec<OsString>> {
@@ -343,3 +784,173 @@ pub fn try_exists(path: &HostPath) -> io::Result<bool> {
         Err(error) => Err(error),
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::os::unix::fs::PermissionsExt;
+
+    fn tempdir_path(tmpdir: &tempfile::TempDir) -> HostPath {
+        HostPath::try_from(tmpdir.path().canonicalize().unwrap()).unwrap()
+    }
+
+    #[test]
+    fn rmtree_read_only() {
+        // Go's module cache has read-only directories with files inside.
+        let tmpdir = tempfile::tempdir().unwrap();
+        let go = tempdir_path(&tmpdir).join("go");
+        let module = go.join("pkg").join("mod").join("example.com@v1.0.0");
+        std::fs::create_dir_all(module.join("sub").as_host_raw()).unwrap();
+        std::fs::write(module.join("go.mod").as_host_raw(), "module example.com\n").unwrap();
+        std::fs::write(
+            module.join("sub").join("a.go").as_host_raw(),
+            "package sub\n",
+        )
+        .unwrap();
+        for dir in [module.join("sub"), module.clone()] {
+            std::fs::set_permissions(dir.as_host_raw(), std::fs::Permissions::from_mode(0o555))
+                .unwrap();
+        }
+        rmtree(&go).unwrap();
+        assert!(!try_exists(&go).unwrap());
+    }
+
+    #[test]
+    fn create_dir_or_subvolume_fallback() {
+        let tmpdir = tempfile::tempdir().unwrap();
+        if is_btrfs(tmpdir.path()) {
+            // The fallback only applies off btrfs.
+            return;
+        }
+        let home = tempdir_path(&tmpdir).join("home").join("env");
+        create_dir_or_subvolume(&home).unwrap();
+        assert!(home.as_host_raw().is_dir());
+        assert!(!is_btrfs_subvolume(&home));
+
+        std::fs::write(home.join("file").as_host_raw(), "x").unwrap();
+        try_delete_subvolume(&home);
+        assert!(try_exists(&home.join("file")).unwrap());
+
+        // Creating an existing directory is fine and leaves it alone.
+        create_dir_or_subvolume(&home).unwrap();
+        assert!(try_exists(&home.join("file")).unwrap());
+    }
+
+    #[test]
+    fn summarize_dir_with_threads() {
+        use std::os::unix::fs::MetadataExt;
+
+        let tmpdir = tempfile::tempdir().unwrap();
+        let tree = tempdir_path(&tmpdir).join("tree");
+        let outside = tempdir_path(&tmpdir).join("outside");
+        std::fs::create_dir_all(tree.join("a").join("b").join("c").as_host_raw()).unwrap();
+        std::fs::create_dir(outside.as_host_raw()).unwrap();
+        std::fs::write(outside.join("big").as_host_raw(), vec![1u8; 1 << 20]).unwrap();
+        std::fs::write(tree.join("top").as_host_raw(), vec![3u8; 10_000]).unwrap();
+        std::fs::hard_link(
+            tree.join("top").as_host_raw(),
+            tree.join("a/top").as_host_raw(),
+        )
+        .unwrap();
+        std::fs::write(tree.join("a").join("one").as_host_raw(), "one").unwrap();
+        std::fs::write(tree.join("a/b/two").as_host_raw(), vec![2u8; 10_000]).unwrap();
+        std::fs::write(tree.join("a/b/c/three").as_host_raw(), "three").unwrap();
+        std::os::unix::fs::symlink(outside.as_host_raw(), tree.join("a/link").as_host_raw())
+            .unwrap();
+        let locked = tree.join("locked");
+        std::fs::create_dir(locked.as_host_raw()).unwrap();
+        std::fs::write(locked.join("hidden").as_host_raw(), "hidden").unwrap();
+        std::fs::set_permissions(locked.as_host_raw(), std::fs::Permissions::from_mode(0o000))
+            .unwrap();
+
+        // Everything except the contents of `locked` (which can't be listed)
+        // and of `outside` (since the symlink must not be followed). The
+        // second link to `top` isn't counted again, but the tree's own
+        // directory is.
+        let mut expected_size = std::fs::metadata(tree.as_host_raw()).unwrap().blocks() * 512;
+        let mut expected_modified = UNIX_EPOCH;
+        for path in [
+            "top",
+            "a",
+            "a/one",
+            "a/b",
+            "a/b/two",
+            "a/b/c",
+            "a/b/c/three",
+            "a/link",
+            "locked",
+        ] {
+            let metadata = std::fs::symlink_metadata(tree.join(path).as_host_raw()).unwrap();
+            expected_size += metadata.blocks() * 512;
+            expected_modified = expected_modified.max(metadata.modified().unwrap());
+        }
+        // Root can list `locked` anyway.
+        let is_root = rustix::process::geteuid().as_raw() == 0;
+        if is_root {
+            let metadata = std::fs::symlink_metadata(locked.join("hidden").as_host_raw()).unwrap();
+            expected_size += metadata.blocks() * 512;
+            expected_modified = expected_modified.max(metadata.modified().unwrap());
+        }
+
+        for threads in [1, 2, 8] {
+            let summary = super::summarize_dir_with_threads(&tree, threads).unwrap();
+            assert_eq!(summary.total_size, expected_size, "threads: {threads}");
+            assert_eq!(
+                summary.last_modified, expected_modified,
+                "threads: {threads}"
+            );
+            assert_eq!(summary.errors, !is_root, "threads: {threads}");
+        }
+
+        std::fs::set_permissions(locked.as_host_raw(), std::fs::Permissions::from_mode(0o755))
+            .unwrap();
+    }
+
+    #[test]
+    fn dir_summary_cache() {
+        const FAKE_SIZE: u64 = 123_456_789;
+
+        let tmpdir = tempfile::tempdir().unwrap();
+        let tree = tempdir_path(&tmpdir).join("tree");
+        std::fs::create_dir(tree.as_host_raw()).unwrap();
+        std::fs::write(tree.join("file").as_host_raw(), "file").unwrap();
+        let actual_size = super::summarize_dir(&tree).unwrap().total_size;
+
+        let cache = DirSummaryCache {
+            dir: tempdir_path(&tmpdir).join("cache"),
+            enabled: true,
+        };
+        let cache_path = cache.cache_path(&tree);
+        let read = || -> CachedDirSummary {
+            serde_json::from_slice(&std::fs::read(cache_path.as_host_raw()).unwrap()).unwrap()
+        };
+        let write = |cached: &CachedDirSummary| cache.write(&cache_path, cached).unwrap();
+        let size = || cache.summarize_dir(&tree).unwrap().total_size;
+
+        // Miss: nothing is cached yet, so this stores an entry.
+        assert_eq!(size(), actual_size);
+        assert!(try_exists(&cache_path).unwrap());
+
+        // Hit: a fresh entry with a matching fingerprint is used as is.
+        let mut cached = read();
+        cached.summary.total_size = FAKE_SIZE;
+        write(&cached);
+        assert_eq!(size(), FAKE_SIZE);
+
+        // Miss: the fingerprint doesn't match.
+        let mut cached = read();
+        cached.fingerprint = UNIX_EPOCH;
+        write(&cached);
+        assert_eq!(size(), actual_size);
+
+        // Miss: the entry has expired.
+        let mut cached = read();
+        cached.summary.total_size = FAKE_SIZE;
+        cached.created -= DirSummaryCache::MAX_AGE + Duration::from_secs(1);
+        write(&cached);
+        assert_eq!(size(), actual_size);
+
+        cache.forget(&tree);
+        assert!(!try_exists(&cache_path).unwrap());
+    }
+}
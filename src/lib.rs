@@ -54,7 +54,7 @@ mod encoding;
 use encoding::FilenameEncoder;
 
 mod fs_util;
-use fs_util::{try_exists, DirSummary};
+use fs_util::{try_exists, DirSummary, DirSummaryCache};
 
 mod os_util;
 use os_util::{get_hostname, host_home_dir};
@@ -101,6 +101,8 @@ struct CubicleShared {
     code_package_dir: HostPath,
     user_package_dir: HostPath,
     random_name_gen: RandomNameGenerator,
+    dir_summary_cache: DirSummaryCache,
+    apt_satisfied: apt::Satisfied,
     env_init_script: &'static [u8],
 }
 
@@ -208,6 +210,8 @@ impl Cubicle {
         let eff_word_list_dir = xdg_cache_home.join("cubicle");
         let random_name_gen = RandomNameGenerator::new(eff_word_list_dir);
 
+        let dir_summary_cache = DirSummaryCache::new(xdg_cache_home.join("cubicle").join("du"));
+
         let shared = Rc::new(CubicleShared {
             config,
             shell,
@@ -219,6 +223,8 @@ impl Cubicle {
             code_package_dir,
             user_package_dir,
             random_name_gen,
+            dir_summary_cache,
+            apt_satisfied: apt::Satisfied::default(),
             env_init_script: std::include_bytes!("env-init.sh"),
         });
 
@@ -275,11 +281,18 @@ impl Cubicle {
 
     /// Returns a detailed description of the current environments.
     pub fn get_environments(&self) -> Result<BTreeMap<EnvironmentName, EnvironmentDetails>> {
+        self.get_environments_(None)
+    }
+
+    fn get_environments_(
+        &self,
+        cache: Option<&DirSummaryCache>,
+    ) -> Result<BTreeMap<EnvironmentName, EnvironmentDetails>> {
         Ok(self
             .get_environment_names()?
             .into_iter()
             .map(|name| {
-                let summary = self.runner.files_summary(&name).unwrap_or_else(|e| {
+                let summary = self.runner.files_summary(&name, cache).unwrap_or_else(|e| {
                     warn(e.context(format!("failed to summarize disk usage for {name}")));
                     EnvFilesSummary {
                         home_dir_path: None,
@@ -324,7 +337,9 @@ impl Cubicle {
             }
 
             ListFormat::Default => {
-                let envs = self.get_environments()?;
+                // The table is for people, so it can show cached sizes that
+                // may be a bit out of date. The JSON format is exact.
+                let envs = self.get_environments_(Some(&self.shared.dir_summary_cache))?;
                 let nw = envs
                     .keys()
                     .map(|name| name.as_str().len())
@@ -686,21 +701,23 @@ where
     }
 }
 
+/// Each unit of time for [`rel_time`] with the smallest number of seconds
+/// displayed in that unit and the number of seconds in one of that unit.
+const TIME_UNITS: [(f64, f64, &str); 3] = [
+    (0.0, 60.0, "minutes"),
+    (59.5 * 60.0, 60.0 * 60.0, "hours"),
+    (23.5 * 60.0 * 60.0, 24.0 * 60.0 * 60.0, "days"),
+];
+
 fn rel_time(duration: Option<Duration>) -> String {
-    let mut duration = match duration {
+    let duration = match duration {
         Some(duration) => duration.as_secs_f64(),
         None => return String::from("N/A"),
     };
-    duration /= 60.0;
-    if duration < 59.5 {
-        return format!("{duration:.0} minutes");
-    }
-    duration /= 60.0;
-    if duration < 23.5 {
-        return format!("{duration:.0} hours");
-    }
-    duration /= 24.0;
-    format!("{duration:.0} days")
+    // The first unit's minimum is 0, so `i` is at least 1.
+    let i = TIME_UNITS.partition_point(|(min, _, _)| *min <= duration);
+    let (_, divisor, unit) = TIME_UNITS[i - 1];
+    format!("{:.0} {unit}", duration / divisor)
 }
 
 fn nonzero_time(t: SystemTime) -> Option<SystemTime> {
@@ -720,7 +737,7 @@ pub struct EnvironmentDetails {
     /// If true, at least one error was encountered while calculating the
     /// `home_dir_size` and `home_dir_mtime` fields.
     pub home_dir_du_error: bool,
-    /// The total size in bytes of `home_dir`.
+    /// The disk space used by `home_dir`, in bytes, as `du -s` would count it.
     pub home_dir_size: u64,
     /// The most recent time that `home_dir` or any file or directory within
     /// it was modified.
@@ -731,7 +748,7 @@ pub struct EnvironmentDetails {
     /// If true, at least one error was encountered while calculating the
     /// `work_dir_size` and `work_dir_mtime` fields.
     pub work_dir_du_error: bool,
-    /// The total size in bytes of `work_dir`.
+    /// The disk space used by `work_dir`, in bytes, as `du -s` would count it.
     pub work_dir_size: u64,
     /// The most recent time that `work_dir` or any file or directory within
     /// it was modified.
@@ -752,3 +769,20 @@ pub mod hidden {
         super::host_home_dir().as_host_raw()
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn rel_time_units() {
+        let secs = |secs| rel_time(Some(Duration::from_secs(secs)));
+        assert_eq!("N/A", rel_time(None));
+        assert_eq!("0 minutes", secs(0));
+        assert_eq!("59 minutes", secs(3569));
+        assert_eq!("1 hours", secs(3570));
+        assert_eq!("23 hours", secs(84599));
+        assert_eq!("1 days", secs(84600));
+        assert_eq!("10 days", secs(10 * 86400));
+    }
+}
@@ -2,7 +2,8 @@ use clap::ValueEnum;
 use serde::Serialize;
 use std::borrow::Borrow;
 use std::cmp::Ordering;
-use std::collections::{BTreeMap, BTreeSet};
+use std::collections::{BTreeMap, BTreeSet, VecDeque};
+use std::ffi::OsStr;
 use std::fmt::{self, Debug, Display};
 use std::io::{self, BufRead, Write};
 use std::path::{Path, PathBuf};
@@ -14,7 +15,8 @@ use crate::somehow::{somehow as anyhow, warn, Context, Error, LowLevelResult, Re
 
 use super::encoding::FilenameEncoder;
 use super::fs_util::{
-    create_tar_from_dir, file_size, summarize_dir, try_exists, try_iterdir, DirSummary, TarOptions,
+    create_tar_from_dir, file_size, modified_since, summarize_dir, try_exists, try_iterdir,
+    TarOptions,
 };
 use super::runner::{EnvironmentExists, Init, Runner, RunnerCommand};
 use super::{rel_time, time_serialize_opt, Bytes, Cubicle, EnvironmentName, HostPath, RunnerKind};
@@ -145,6 +147,106 @@ fn transitive_depends(
     Ok(visitor.visited)
 }
 
+/// Returns the definition for the given package, which must not be a Debian
+/// package.
+fn package_spec<'a>(
+    full_name: &FullPackageName,
+    specs: &'a PackageSpecs,
+) -> Result<&'a PackageSpec> {
+    match &full_name.0 {
+        PackageNamespace::Debian => unreachable!(),
+        PackageNamespace::Root => specs
+            .get(&full_name.1)
+            .ok_or_else(|| anyhow!("could not find definition for package {}", full_name.1)),
+        PackageNamespace::Managed(manager) => {
+            let spec = specs.get(manager).ok_or_else(|| {
+                anyhow!("could not find definition for package manager {manager}")
+            })?;
+            if !spec.manifest.package_manager {
+                return Err(anyhow!("package {manager} is not a package manager"));
+            }
+            Ok(spec)
+        }
+    }
+}
+
+/// Returns the non-Debian packages that the given manifest depends on or
+/// build-depends on. A package listed in both appears once.
+fn package_depends(manifest: &Manifest) -> BTreeSet<FullPackageName> {
+    manifest
+        .depends
+        .iter()
+        .chain(manifest.build_depends.iter())
+        .filter(|(ns, _)| *ns != &PackageNamespace::Debian)
+        .flat_map(|(ns, deps)| {
+            deps.keys()
+                .map(|dep| FullPackageName(ns.clone(), dep.clone()))
+        })
+        .collect()
+}
+
+/// Returns the packages in `depends` ordered so that each comes after all of
+/// its dependencies.
+///
+/// This uses Kahn's algorithm for a topological sort. Packages that are part
+/// of a dependency cycle, or that depend on packages missing from `depends`,
+/// can't be ordered, and the error lists them.
+fn build_order(
+    depends: &BTreeMap<FullPackageName, BTreeSet<FullPackageName>>,
+) -> Result<Vec<FullPackageName>> {
+    // `waiting_on` counts each package's dependencies that haven't been
+    // ordered yet.
+    let mut waiting_on: BTreeMap<&FullPackageName, usize> = BTreeMap::new();
+    let mut dependents: BTreeMap<&FullPackageName, Vec<&FullPackageName>> = BTreeMap::new();
+    for (full_name, deps) in depends {
+        waiting_on.insert(full_name, deps.len());
+        for dep in deps {
+            dependents.entry(dep).or_default().push(full_name);
+        }
+    }
+    let mut ready: VecDeque<&FullPackageName> = depends
+        .iter()
+        .filter(|(_, deps)| deps.is_empty())
+        .map(|(full_name, _)| full_name)
+        .collect();
+
+    let mut order = Vec::with_capacity(depends.len());
+    while let Some(full_name) = ready.pop_front() {
+        waiting_on.remove(full_name);
+        order.push(full_name.clone());
+        for dependent in dependents.get(full_name).into_iter().flatten() {
+            let count = waiting_on.get_mut(dependent).unwrap();
+            *count -= 1;
+            if *count == 0 {
+                ready.push_back(dependent);
+            }
+        }
+    }
+
+    if !waiting_on.is_empty() {
+        return Err(anyhow!(
+            "package dependencies are unsatisfiable for: {}",
+            waiting_on
+                .keys()
+                .map(|full_name| full_name.to_string())
+                .collect::<Vec<_>>()
+                .join(", ")
+        ));
+    }
+    Ok(order)
+}
+
+/// Returns the name of the package whose build output is the given file in
+/// the package cache, if it's a package tarball (see
+/// [`Cubicle::package_tar`]).
+fn package_name_from_tar(filename: &OsStr) -> Option<FullPackageName> {
+    FilenameEncoder::decode(filename)
+        .ok()
+        .as_ref()
+        .and_then(|filename| filename.strip_suffix(".tar"))
+        .and_then(|prefix| FullPackageName::from_str(prefix).ok())
+}
+
 impl Cubicle {
     pub(super) fn resolve_debian_packages(
         &self,
@@ -309,90 +411,49 @@ impl Cubicle {
         conditions: &UpdatePackagesConditions,
     ) -> Result<()> {
         let now = SystemTime::now();
-        let mut todo: Vec<FullPackageName> =
-            transitive_depends(packages, specs, BuildDepends(true))?
-                .into_iter()
-                .filter(|FullPackageName(ns, _name)| ns != &PackageNamespace::Debian)
-                .collect();
-        let mut done: BTreeSet<FullPackageName> = BTreeSet::new();
-        loop {
-            let start_todos = todo.len();
-            if start_todos == 0 {
-                return Ok(());
+        // The dependencies are gathered from the manifests once here and
+        // reused when checking whether packages are stale.
+        let mut depends: BTreeMap<FullPackageName, BTreeSet<FullPackageName>> = BTreeMap::new();
+        for full_name in transitive_depends(packages, specs, BuildDepends(true))? {
+            if full_name.0 != PackageNamespace::Debian {
+                let spec = package_spec(&full_name, specs)?;
+                depends.insert(full_name, package_depends(&spec.manifest));
             }
-            let mut later = Vec::new();
-
-            for full_name in todo {
-                let spec = match &full_name.0 {
-                    PackageNamespace::Debian => unreachable!(),
-                    PackageNamespace::Root => specs.get(&full_name.1).ok_or_else(|| {
-                        anyhow!("could not find definition for package {}", full_name.1)
-                    })?,
-                    PackageNamespace::Managed(manager) => {
-                        let spec = specs.get(manager).ok_or_else(|| {
-                            anyhow!("could not find definition for package manager {manager}")
-                        })?;
-                        if !spec.manifest.package_manager {
-                            return Err(anyhow!("package {manager} is not a package manager"));
-                        }
-                        spec
-                    }
-                };
+        }
 
-                let deps_ready = spec
-                    .manifest
-                    .depends
-                    .iter()
-                    .chain(spec.manifest.build_depends.iter())
-                    .all(|(ns, deps)| {
-                        ns == &PackageNamespace::Debian
-                            || deps
-                                .keys()
-                                .all(|dep| done.contains(&FullPackageName(ns.clone(), dep.clone())))
-                    });
-
-                if deps_ready {
-                    let needs_build = {
-                        if spec.update.is_none() {
-                            false
-                        } else {
-                            let when = if packages.contains(&full_name) {
-                                conditions.named
-                            } else {
-                                conditions.dependencies
-                            };
-                            match when {
-                                ShouldPackageUpdate::Always => true,
-                                ShouldPackageUpdate::IfStale => {
-                                    self.package_is_stale(&full_name, spec, now)?
-                                }
-                                ShouldPackageUpdate::IfRequired => {
-                                    self.last_built(&full_name).is_none()
-                                }
-                            }
-                        }
+        let mut built = self.last_built_all()?;
+        for full_name in build_order(&depends)? {
+            let spec = package_spec(&full_name, specs)?;
+            let needs_build = {
+                if spec.update.is_none() {
+                    false
+                } else {
+                    let when = if packages.contains(&full_name) {
+                        conditions.named
+                    } else {
+                        conditions.dependencies
                     };
-                    if needs_build {
-                        self.update_package(&full_name, spec, specs)?;
+                    match when {
+                        ShouldPackageUpdate::Always => true,
+                        ShouldPackageUpdate::IfStale => self.package_is_stale(
+                            &full_name,
+                            spec,
+                            &depends[&full_name],
+                            now,
+                            &built,
+                        )?,
+                        ShouldPackageUpdate::IfRequired => !built.contains_key(&full_name),
                     }
-                    done.insert(full_name);
-                } else {
-                    later.push(full_name);
+                }
+            };
+            if needs_build {
+                self.update_package(&full_name, spec, specs)?;
+                if let Some(time) = self.last_built(&full_name) {
+                    built.insert(full_name, time);
                 }
             }
-            if later.len() == start_todos {
-                later.sort();
-                return Err(anyhow!(
-                    "package dependencies are unsatisfiable for: {}",
-                    later
-                        .iter()
-                        .map(|full_name| full_name.to_string())
-                        .collect::<Vec<_>>()
-                        .join(", ")
-                ));
-            }
-            todo = later;
         }
+        Ok(())
     }
 
     fn package_tar(&self, name: &FullPackageName) -> HostPath {
@@ -407,13 +468,7 @@ impl Cubicle {
     fn package_names_from_tars(&self) -> Result<Vec<FullPackageName>> {
         Ok(try_iterdir(&self.shared.package_cache)?
             .iter()
-            .filter_map(|filename| {
-                FilenameEncoder::decode(filename)
-                    .ok()
-                    .as_ref()
-                    .and_then(|filename| filename.strip_suffix(".tar"))
-                    .and_then(|prefix| FullPackageName::from_str(prefix).ok())
-            })
+            .filter_map(|filename| package_name_from_tar(filename))
             .collect())
     }
 
@@ -441,14 +496,49 @@ impl Cubicle {
         metadata.modified().ok()
     }
 
+    /// Returns when each package in the package cache was last built.
+    ///
+    /// This lists the package cache directory once, rather than calling
+    /// [`Self::last_built`] for each package.
+    fn last_built_all(&self) -> Result<BTreeMap<FullPackageName, SystemTime>> {
+        let package_cache = &self.shared.package_cache;
+        let readdir = match std::fs::read_dir(package_cache.as_host_raw()) {
+            Ok(readdir) => readdir,
+            Err(e) if e.kind() == io::ErrorKind::NotFound => return Ok(BTreeMap::new()),
+            Err(e) => {
+                return Err(e)
+                    .with_context(|| format!("failed to list directory {package_cache:?}"))
+            }
+        };
+        let mut built = BTreeMap::new();
+        for entry in readdir {
+            let entry =
+                entry.with_context(|| format!("failed to list directory {package_cache:?}"))?;
+            let name = match package_name_from_tar(&entry.file_name()) {
+                Some(name) => name,
+                None => continue,
+            };
+            // Like `last_built`, this follows symlinks, so that the times
+            // compare like with like.
+            if let Ok(time) =
+                std::fs::metadata(entry.path()).and_then(|metadata| metadata.modified())
+            {
+                built.insert(name, time);
+            }
+        }
+        Ok(built)
+    }
+
     fn package_is_stale(
         &self,
         package_name: &FullPackageName,
         spec: &PackageSpec,
+        depends: &BTreeSet<FullPackageName>,
         now: SystemTime,
+        last_built: &BTreeMap<FullPackageName, SystemTime>,
     ) -> Result<bool> {
-        let built = match self.last_built(package_name) {
-            Some(built) => built,
+        let built = match last_built.get(package_name) {
+            Some(built) => *built,
             None => return Ok(true),
         };
         if let Some(threshold) = self.shared.config.auto_update {
@@ -458,24 +548,12 @@ impl Cubicle {
                 _ => {}
             }
         }
-        let DirSummary { last_modified, .. } = summarize_dir(&spec.dir)?;
-        if last_modified > built {
+        if modified_since(&spec.dir, built)? {
             return Ok(true);
         }
-        for (ns, table) in spec
-            .manifest
-            .build_depends
+        Ok(depends
             .iter()
-            .chain(spec.manifest.depends.iter())
-        {
-            for name in table.keys() {
-                let full_name = FullPackageName(ns.clone(), name.clone());
-                if matches!(self.last_built(&full_name), Some(b) if b > built) {
-                    return Ok(true);
-                }
-            }
-        }
-        Ok(false)
+            .any(|dep| matches!(last_built.get(dep), Some(b) if *b > built)))
     }
 
     fn package_build_failed(&self, package_name: &FullPackageName) -> Result<bool> {
@@ -1234,4 +1312,82 @@ mod tests {
 
         assert_eq!("b b.a c c.x d", names.map(|name| name.unquoted()).join(" "));
     }
+
+    fn depends_map(
+        edges: &[(&str, &[&str])],
+    ) -> BTreeMap<FullPackageName, BTreeSet<FullPackageName>> {
+        edges
+            .iter()
+            .map(|(name, deps)| {
+                (
+                    FullPackageName::from_str(name).unwrap(),
+                    deps.iter()
+                        .map(|dep| FullPackageName::from_str(dep).unwrap())
+                        .collect(),
+                )
+            })
+            .collect()
+    }
+
+    fn unquoted(order: &[FullPackageName]) -> String {
+        order
+            .iter()
+            .map(|name| name.unquoted())
+            .collect::<Vec<_>>()
+            .join(" ")
+    }
+
+    #[test]
+    fn build_order_diamond() {
+        // `a` depends on `b` and `c`, which both depend on `d`, which depends
+        // on the package manager `m`.
+        let depends = depends_map(&[
+            ("a", &["b", "c"]),
+            ("b", &["m.d"]),
+            ("c", &["m.d"]),
+            ("m", &[]),
+            ("m.d", &["m"]),
+            ("z", &[]),
+        ]);
+        assert_eq!("m z m.d b c a", unquoted(&build_order(&depends).unwrap()));
+    }
+
+    #[test]
+    fn build_order_duplicate_depends() {
+        let b = || BTreeMap::from([(PackageName::strict_from_str("b").unwrap(), Dependency {})]);
+        let manifest = Manifest {
+            package_manager: false,
+            depends: BTreeMap::from([(PackageNamespace::Root, b())]),
+            build_depends: BTreeMap::from([
+                (PackageNamespace::Root, b()),
+                (
+                    PackageNamespace::Debian,
+                    BTreeMap::from([(PackageName::loose_from_str("curl").unwrap(), Dependency {})]),
+                ),
+            ]),
+        };
+        let deps = package_depends(&manifest);
+        assert_eq!("b", unquoted(&Vec::from_iter(deps.iter().cloned())));
+
+        let depends = BTreeMap::from([
+            (FullPackageName::from_str("a").unwrap(), deps),
+            (FullPackageName::from_str("b").unwrap(), BTreeSet::new()),
+        ]);
+        assert_eq!("b a", unquoted(&build_order(&depends).unwrap()));
+    }
+
+    #[test]
+    fn build_order_cycle() {
+        let depends = depends_map(&[
+            ("a", &[]),
+            ("b", &["a", "d"]),
+            ("c", &["b"]),
+            ("d", &["c"]),
+            ("e", &["c"]),
+        ]);
+        assert_eq!(
+            r#"package dependencies are unsatisfiable for: "b", "c", "d", "e""#,
+            build_order(&depends).unwrap_err().to_string()
+        );
+    }
 }
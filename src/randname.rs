@@ -1,5 +1,5 @@
 use rand::seq::SliceRandom;
-use std::io::{self, BufRead};
+use std::io::{self, BufRead, Read, Write};
 
 use super::HostPath;
 use crate::somehow::{somehow as anyhow, warn, Context, Result};
@@ -24,8 +24,8 @@ impl RandomNameGenerator {
         // 1. Prefer the EFF short word list. See https://www.eff.org/dice for
         // more info.
         let eff = || -> Result<String> {
-            let file = self.download_or_open_eff_list()?;
-            from_reader(file, |w| Ok(w.len() < 10 && filter(w)?))
+            let file = self.open_clean_eff_list()?;
+            from_reader(file, 10, &filter)
         };
         match eff().context("failed to extract word from EFF list") {
             Ok(word) => return Ok(word),
@@ -35,7 +35,7 @@ impl RandomNameGenerator {
         // 2. /usr/share/dict/words
         let dict = || -> Result<String> {
             let file = std::fs::File::open("/usr/share/dict/words").enough_context()?;
-            from_reader(file, |w| Ok(w.len() < 6 && filter(w)?))
+            from_reader(file, 6, &filter)
         };
         match dict().context("failed to extract word from `/usr/share/dict/words`") {
             Ok(word) => return Ok(word),
@@ -71,6 +71,20 @@ impl RandomNameGenerator {
         ))
     }
 
+    /// Opens a cached copy of the EFF short word list that contains only the
+    /// usable words, one per line. Creates it if needed.
+    fn open_clean_eff_list(&self) -> Result<std::fs::File> {
+        let clean_word_list = self.cache_dir.join("eff_short_wordlist_1.clean.txt");
+        match std::fs::File::open(&clean_word_list.as_host_raw()) {
+            Ok(file) => return Ok(file),
+            Err(e) if e.kind() == io::ErrorKind::NotFound => {}
+            Err(e) => return Err(e).todo_context(),
+        }
+        let words = clean_eff_list(self.download_or_open_eff_list()?)?;
+        self.write_atomically(&clean_word_list, &words)?;
+        std::fs::File::open(&clean_word_list.as_host_raw()).todo_context()
+    }
+
     fn download_or_open_eff_list(&self) -> Result<std::fs::File> {
         let eff_word_list = self.cache_dir.join("eff_short_wordlist_1.txt");
         let file = match std::fs::File::open(&eff_word_list.as_host_raw()) {
@@ -82,38 +96,65 @@ impl RandomNameGenerator {
                     .with_context(|| {
                         format!("error downloading word list from {:?}", self.eff_url)
                     })?;
-                std::fs::create_dir_all(self.cache_dir.as_host_raw()).todo_context()?;
-                std::fs::write(&eff_word_list.as_host_raw(), body).todo_context()?;
+                self.write_atomically(&eff_word_list, &body)?;
                 std::fs::File::open(&eff_word_list.as_host_raw()).todo_context()?
             }
             Err(e) => return Err(e).todo_context(),
         };
         Ok(file)
     }
+
+    /// Writes a file in the cache directory via a temporary file and a rename,
+    /// so that an interrupted write never leaves a truncated file behind.
+    fn write_atomically(&self, path: &HostPath, contents: &str) -> Result<()> {
+        let write = || -> io::Result<()> {
+            std::fs::create_dir_all(self.cache_dir.as_host_raw())?;
+            let mut file = tempfile::NamedTempFile::new_in(self.cache_dir.as_host_raw())?;
+            file.write_all(contents.as_bytes())?;
+            file.persist(path.as_host_raw())?;
+            Ok(())
+        };
+        write().with_context(|| format!("failed to write {path:?}"))
+    }
 }
 
-fn from_reader<R, F>(reader: R, filter: F) -> Result<String>
+/// Returns the words from the EFF list that are short and plain enough to use
+/// in environment names, one per line. This drops the diceware numbers.
+fn clean_eff_list<R: io::Read>(reader: R) -> Result<String> {
+    let mut clean = String::new();
+    for line in io::BufReader::new(reader).lines() {
+        let line = line.todo_context()?;
+        for word in line.split_ascii_whitespace() {
+            if word.len() < 10 && word.chars().all(|c| c.is_ascii_lowercase()) {
+                clean.push_str(word);
+                clean.push('\n');
+            }
+        }
+    }
+    Ok(clean)
+}
+
+/// Returns a random word from `reader` that is shorter than `max_len` and
+/// passes `filter`.
+///
+/// This reads the input into a single buffer and collects the candidate words
+/// as slices of it in one pass, then samples from those.
+fn from_reader<R, F>(mut reader: R, max_len: usize, filter: F) -> Result<String>
 where
     R: std::io::Read,
     F: Fn(&str) -> Result<bool>,
 {
     let mut rng = rand::thread_rng();
-    let reader = io::BufReader::new(reader);
-    let lines = reader
-        .lines()
-        .collect::<Result<Vec<String>, _>>()
-        .todo_context()?;
-    for _ in 0..200 {
-        if let Some(line) = lines.choose(&mut rng) {
-            for word in line.split_ascii_whitespace() {
-                if word.chars().all(char::is_numeric) {
-                    // probably diceware numbers
-                    continue;
-                }
-                if filter(word)? {
-                    return Ok(word.to_owned());
-                }
-            }
+    let mut buf = String::new();
+    reader.read_to_string(&mut buf).todo_context()?;
+    let words = buf
+        .split_ascii_whitespace()
+        // Skip anything all numeric, as those are probably diceware numbers.
+        .filter(|word| word.len() < max_len && !word.chars().all(char::is_numeric))
+        .collect::<Vec<&str>>();
+    for word in words.choose_multiple(&mut rng, 200) {
+        if filter(word)? {
+            return Ok((*word).to_owned());
         }
     }
     Err(anyhow!("found no suitable word"))
@@ -124,6 +165,25 @@ mod tests {
     use super::HostPath;
     use insta::assert_snapshot;
 
+    #[test]
+    fn clean_eff_list() {
+        let list = "11111\tacid\n11112\tacorn\n11113\tpineapple\n11114\twatermelon\n11115\tyo-yo\n";
+        assert_eq!(
+            super::clean_eff_list(list.as_bytes()).unwrap(),
+            "acid\nacorn\npineapple\n"
+        );
+    }
+
+    #[test]
+    fn from_reader() {
+        let list = "11111\tacid\n11112\twatermelon\n";
+        assert_eq!(
+            super::from_reader(list.as_bytes(), 10, |_| Ok(true)).unwrap(),
+            "acid"
+        );
+        assert!(super::from_reader(list.as_bytes(), 10, |w| Ok(w != "acid")).is_err());
+    }
+
     #[test]
     fn download_or_open_eff_list() {
         let tmpdir = tempfile::tempdir().unwrap();
@@ -1,7 +1,7 @@
 use std::io;
 use std::path::Path;
 
-use super::fs_util::DirSummary;
+use super::fs_util::{DirSummary, DirSummaryCache};
 use super::{EnvironmentName, HostPath};
 use crate::somehow::{Context, Result};
 
@@ -55,7 +55,14 @@ pub trait Runner {
 
     /// Calculates and returns information about the filesystem paths used for
     /// the environment.
-    fn files_summary(&self, name: &EnvironmentName) -> Result<EnvFilesSummary>;
+    ///
+    /// If `cache` is given, the directory summaries may come from it and be
+    /// somewhat out of date. See [`DirSummaryCache`].
+    fn files_summary(
+        &self,
+        name: &EnvironmentName,
+        cache: Option<&DirSummaryCache>,
+    ) -> Result<EnvFilesSummary>;
 
     /// Stops the environment, if running, and any processes running in it.
     ///
@@ -182,14 +189,18 @@ impl Runner for CheckedRunner {
             .with_context(|| format!("failed to check if environment {name} exists"))
     }
 
-    fn files_summary(&self, name: &EnvironmentName) -> Result<EnvFilesSummary> {
+    fn files_summary(
+        &self,
+        name: &EnvironmentName,
+        cache: Option<&DirSummaryCache>,
+    ) -> Result<EnvFilesSummary> {
         assert_ne!(
             self.exists(name)?,
             EnvironmentExists::NoEnvironment,
             "Environment {name} should partially or fully exist before files_summary"
         );
         self.0
-            .files_summary(name)
+            .files_summary(name, cache)
             .with_context(|| format!("failed to summarize filesystem usage for environment {name}"))
     }
 
@@ -5,7 +5,7 @@ use std::rc::Rc;
 use std::time::{SystemTime, UNIX_EPOCH};
 
 use super::command_ext::Command;
-use super::fs_util::{summarize_dir, DirSummary};
+use super::fs_util::{summarize_dir, DirSummary, DirSummaryCache};
 use super::runner::{EnvFilesSummary, EnvironmentExists, Init, Runner, RunnerCommand};
 use super::{apt, CubicleShared, EnvironmentName, ExitStatusError, HostPath};
 use crate::encoding::{percent_decode, percent_encode, FilenameEncoder};
@@ -187,7 +187,7 @@ impl User {
             .args(seeds.iter().map(|s| s.as_host_raw()))
             .stdout(Stdio::piped())
             .scoped_spawn()?;
-        let mut source_stdout = source.stdout().take().unwrap();
+        let source_stdout = source.stdout().take().unwrap();
 
         let mut dest = Command::new("sudo")
             // This used to use `--chdir ~`, but that was introduced
@@ -201,15 +201,9 @@ impl User {
             .arg("--extract")
             .arg("--ignore-zero")
             .env_clear()
-            .stdin(Stdio::piped())
+            .stdin(source_stdout)
             .scoped_spawn()?;
 
-        {
-            let mut dest_stdin = dest.stdin().take().unwrap();
-            io::copy(&mut source_stdout, &mut dest_stdin)?;
-            dest_stdin.flush()?;
-        }
-
         let status = dest.wait()?;
         if !status.success() {
             return Err(anyhow!(
@@ -273,6 +267,7 @@ impl User {
                 .iter()
                 .map(|s| s.as_str())
                 .collect::<Vec<&str>>(),
+            &self.program.apt_satisfied,
         );
 
         let username = self.username_from_environment(env_name);
@@ -428,7 +423,11 @@ impl Runner for User {
         Ok(envs)
     }
 
-    fn files_summary(&self, env_name: &EnvironmentName) -> Result<EnvFilesSummary> {
+    fn files_summary(
+        &self,
+        env_name: &EnvironmentName,
+        _cache: Option<&DirSummaryCache>,
+    ) -> Result<EnvFilesSummary> {
         let username = self.username_from_environment(env_name);
 
         let mut home: Option<HostPath> = None;